@@ -0,0 +1,40 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+'''
+2 Wavelet packets
+Compiled cost kernels (optional, see cost.py)
+Build with: python setup.py build_ext --inplace
+@author     Matthias Moulin & Vincent Peeters
+@version    1.0
+'''
+
+from libc.math cimport fabs, log2
+
+def cost_shannon(double[::1] A):
+    '''
+    Computes the Shannen entropy of a flattened input signal.
+    @param A:         Contiguous 1D view on the input signal.
+    '''
+    cdef double cost = 0.0
+    cdef double x
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(A.shape[0]):
+            x = A[i]
+            if x != 0.0:
+                cost -= x * x * log2(fabs(x))
+    return cost
+
+def cost_threshold(double[::1] A, double threshold):
+    '''
+    Computes the number of entries of a flattened input signal
+    higher (in absolute value) than the given threshold.
+    @param A:         Contiguous 1D view on the input signal.
+    @param threshold: The threshold value.
+    '''
+    cdef long cost = 0
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(A.shape[0]):
+            if fabs(A[i]) > threshold:
+                cost = cost + 1
+    return cost
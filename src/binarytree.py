@@ -5,15 +5,24 @@
 @version    1.0
 '''
 
+import collections
 import cost
-import heapq
 import node
 import numpy as np
 import pywt
 
+# pywt >= 0.5 can transform along a single axis of an n-dimensional array,
+# which allows decomposing all siblings of a level in one call instead of
+# one call per node.
+try:
+    pywt.dwt(np.zeros((2, 4)), "db1", axis=-1)
+    _BATCH_DWT = True
+except (TypeError, ValueError):
+    _BATCH_DWT = False
+
 ###############################################################################
 # ANALYSIS ALGORITHM FUNCTIONS
-############################################################################### 
+###############################################################################
        
 def wp(S, costf, wavelet="db4", mode=pywt.MODES.ppd, level=None):
     '''
@@ -36,21 +45,25 @@ def wp(S, costf, wavelet="db4", mode=pywt.MODES.ppd, level=None):
     @return:          A list containing the nodes of the 1D discrete wavelet packet transformation,
                       with the best basis according to the given cost function, for the given input signal. 
     '''
+    #Build the wavelet filter bank once instead of re-parsing the name
+    #in every dwt call.
+    if isinstance(wavelet, str):
+        wavelet = pywt.Wavelet(wavelet)
     if (level == None):
-        level = pywt.dwt_max_level(S.shape[0], pywt.Wavelet(wavelet))
-    
+        level = pywt.dwt_max_level(S.shape[0], wavelet)
+
     #Data collection step
-    Nodes = collect(S, wavelet=wavelet, mode=mode, level=level)
+    Nodes = collect(S, wavelet=wavelet, mode=mode, level=level, costf=costf)
     #Dynamic programming upstream traversal
-    mark(Nodes, costf)
+    mark(Nodes)
     #node.print_nodes(Nodes)
     #Dynamic programming downstream traversal
     Result = []
     traverse(Nodes[0][0], Nodes, Result)
     traverse(Nodes[0][1], Nodes, Result)
-    return sorted(Result, cmp=node.compare_low_level_first, reverse=False)
+    return sorted(Result, key=node.key_low_level_first)
                      
-def collect(S, wavelet, mode, level):
+def collect(S, wavelet, mode, level, costf=None):
     '''
     Returns the full binary tree of wavelet packets.
     @param S:         Input signal.
@@ -58,69 +71,85 @@ def collect(S, wavelet, mode, level):
                       and the output type depends on the input type. If the input data is not
                       in one of these types it will be converted to the default double precision
                       data format before performing computations.
-    @param wavelet:   Wavelet to use in the transform. 
+    @param wavelet:   Wavelet to use in the transform.
                       This must be a name of the wavelet from the wavelist() list.
     @param mode:      Signal extension mode to deal with the border distortion problem.
     @param level:     Number of decomposition steps to perform. If the level is None, then the
                       full decomposition up to the level computed with dwt_max_level() function for
                       the given data and wavelet lengths is performed.
+    @param costf:     The (single parameter) cost function. If given, the cost of each
+                      node is computed once on the freshly produced coefficients.
     @return:          The full binary tree of wavelet packets.
     '''
     Nodes = [[] for i in range(level)]
     (Cl, Cr) = pywt.dwt(S, wavelet=wavelet, mode=mode)
     Nodes[0] = [node.Node(Cl, 0, 0), node.Node(Cr, 0, 1)]
+    if costf is not None:
+        for Node in Nodes[0]:
+            Node.cost = Node.best = costf(Node.C)
     for l in range(0, level-1):
         Parents = Nodes[l]
         Childs = []
-        for p in range(len(Parents)):
-            (Cl, Cr) = pywt.dwt(Parents[p].C, wavelet=wavelet, mode=mode)
-            Childs.append(node.Node(Cl, l+1, 2*p))
-            Childs.append(node.Node(Cr, l+1, 2*p+1))
-        Nodes[l+1] = Childs 
+        if _BATCH_DWT:
+            #All siblings of a level have equal length, so they can be
+            #stacked and decomposed in a single call.
+            Cstack = np.stack([Parent.C for Parent in Parents], axis=0)
+            (Cls, Crs) = pywt.dwt(Cstack, wavelet=wavelet, mode=mode, axis=-1)
+            for p in range(len(Parents)):
+                Childs.append(node.Node(Cls[p], l+1, 2*p))
+                Childs.append(node.Node(Crs[p], l+1, 2*p+1))
+        else:
+            for p in range(len(Parents)):
+                (Cl, Cr) = pywt.dwt(Parents[p].C, wavelet=wavelet, mode=mode)
+                Childs.append(node.Node(Cl, l+1, 2*p))
+                Childs.append(node.Node(Cr, l+1, 2*p+1))
+        if costf is not None:
+            for Node in Childs:
+                Node.cost = Node.best = costf(Node.C)
+        Nodes[l+1] = Childs
     return Nodes
-    
-def mark(Nodes, costf):
+
+def mark(Nodes):
     '''
-    Marks every node of nodes with the best cost seen so far. 
+    Marks every node of nodes with the best cost seen so far.
+    The cost (and initial best) of each node must have been computed up
+    front by collect. The costs of a level are gathered into a vector, so
+    the min of each parent cost versus the sum of its child bests is
+    propagated upward with vectorized level operations instead of a
+    Python loop per node.
     @param Nodes:     List containing the nodes of the 1D discrete wavelet packet
                       transformation.
-    @param costf:      The (single parameter) cost function that must be used while
-                      searching for the best basis.
     '''
-    for p in range(len(Nodes[-1])):
-        Node = Nodes[-1][p]
-        cp = costf(Node.C)
-        Node.cost = cp
-        Node.best = cp
+    bests = np.array([Node.best for Node in Nodes[-1]])
     for l in range(len(Nodes)-2, -1, -1):
+        cc = np.reshape(bests, (-1, 2)).sum(axis=1)
+        costs = np.array([Node.cost for Node in Nodes[l]])
+        bests = np.minimum(costs, cc)
         for p in range(len(Nodes[l])):
-            Node = Nodes[l][p]
-            cc = Nodes[l+1][2*p].best + Nodes[l+1][2*p+1].best
-            cp = costf(Node.C)
-            Node.cost = cp
-            if cp <= cc:
-                Node.best = cp
-            else:
-                Node.best = cc 
+            Nodes[l][p].best = bests[p]
           
 def traverse(Node, Nodes, Result):
     '''
-    Traverses the given node.
-    The node will be aadded to the result if it belongs to the best basis.
-    Otherwise the node childs will be traversed recursively.
-    @param Node:      The current node to traverse.
+    Traverses the subtree rooted at the given node with an explicit stack
+    (avoiding Python call overhead and recursion limits at deep levels).
+    A node will be added to the result if it belongs to the best basis.
+    Otherwise the node childs will be traversed.
+    @param Node:      The root node of the subtree to traverse.
     @param Nodes:     List containing the nodes of the 1D discrete wavelet packet
                       transformation.
     @param Result:    Buffer containing the nodes traversed so far that belong
                       to the best basis.
     '''
-    if (Node.best == Node.cost):
-        Result.append(Node)
-    else:
-        i = Node.level + 1
-        j = 2 * Node.index
-        traverse(Nodes[i][j], Nodes, Result)
-        traverse(Nodes[i][j+1], Nodes, Result)                   
+    stack = [Node]
+    while stack:
+        Current = stack.pop()
+        if (Current.best == Current.cost):
+            Result.append(Current)
+        else:
+            i = Current.level + 1
+            j = 2 * Current.index
+            stack.append(Nodes[i][j+1])
+            stack.append(Nodes[i][j])
 
 ###############################################################################
 # SYNTHESIS ALGORITHM FUNCTIONS
@@ -139,34 +168,37 @@ def iwp(Nodes, wavelet="db4", mode=pywt.MODES.ppd):
     @return:          The inverse 1D discrete wavelet packet transformation for the given
                       list containing the nodes of the 1D discrete wavelet packet transformation.
     '''
-    heapq.heapify(Nodes)
-    while len(Nodes) != 1:
-        Node1 = heapq.heappop(Nodes)
-        Node2 = heapq.heappop(Nodes)
-        S = pywt.idwt(Node1.C, Node2.C, wavelet=wavelet, mode=mode, correct_size=True)
-        Merged = node.Node(S, (Node1.level-1), (Node1.index / 2))
-        heapq.heappush(Nodes, Merged)
-    return Nodes[0].C
+    if isinstance(wavelet, str):
+        wavelet = pywt.Wavelet(wavelet)
+    #Bucket the nodes per level: the levels are small and bounded, so
+    #merging the deepest bucket into the one above is O(N) overall and
+    #avoids the Python-level comparisons of a heap.
+    buckets = collections.defaultdict(list)
+    for Node in Nodes:
+        buckets[Node.level].append(Node)
+    for l in range(max(buckets), -1, -1):
+        Level = sorted(buckets.pop(l), key=node.key_low_level_first)
+        for q in range(0, len(Level), 2):
+            Node1 = Level[q]
+            Node2 = Level[q+1]
+            S = pywt.idwt(Node1.C, Node2.C, wavelet=wavelet, mode=mode, correct_size=True)
+            Merged = node.Node(S, l-1, (Node1.index / 2))
+            buckets[l-1].append(Merged)
+    return buckets[-1][0].C
 
 ###############################################################################
 # TESTS
 ############################################################################### 
                                          
-def h(x):
-    if x<0:
-        return 1+x
-    else:
-        return -1+x   
-
 def samples(nb_samples=1000):
-    t = (np.linspace(-1,1,nb_samples+1))[:-1]
-    return np.vectorize(h)(x=t)  
-      
+    t = (np.linspace(-1,1,nb_samples+1, dtype=np.float32))[:-1]
+    return np.where(t<0, 1+t, -1+t)
+
 def get_smooth_func():
-    time = np.linspace(1,40,1000)
+    time = np.linspace(1,40,1000, dtype=np.float32)
     freq = 500
     freqs = 8000
-    return np.sin(2*np.pi*freq/freqs*time)     
+    return np.sin(2*np.pi*freq/freqs*time)
       
 if __name__ == "__main__":
     S = get_smooth_func()
@@ -5,12 +5,56 @@
 @version    1.0
 '''
 
+import math
 import numpy as np
 import pylab
 
+# Optional: Cython-compiled kernels for the cost inner loops (build with
+# `python setup.py build_ext --inplace` in this directory). Preferred over
+# the numba and numpy paths below when present, since it works on Python 2
+# where numba is unavailable.
+try:
+    import _bestbasis
+except ImportError:
+    _bestbasis = None
+
+# Optional: numba-compiled kernels for the cost inner loops.
+# The pure numpy versions below are used when numba is not installed.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+_INV_LN2 = 1.0 / math.log(2.0)
+
+# Below this size the numpy ufunc setup costs more than a plain Python
+# loop over unboxed scalars (measured crossover around 16 elements).
+_SMALL_SIZE = 16
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _shannon_kernel(A):
+        cost = 0.0
+        for i in range(A.shape[0]):
+            x = A[i]
+            if x != 0.0:
+                cost -= x * x * math.log(abs(x))
+        return cost * _INV_LN2
+
+    @njit(cache=True, fastmath=True)
+    def _threshold_kernel(A, threshold):
+        cost = 0
+        for i in range(A.shape[0]):
+            if abs(A[i]) > threshold:
+                cost = cost + 1
+        return cost
+else:
+    _shannon_kernel = None
+    _threshold_kernel = None
+
 ###############################################################################
 # COST FUNCTIONS
-############################################################################### 
+###############################################################################
 
 def cost_threshold(threshold):
     '''
@@ -20,27 +64,44 @@ def cost_threshold(threshold):
     '''
     def cost_fixed_threshold(C):
         '''
-        Computes the number of entries of a 2D input signal
+        Computes the number of entries of a (1D or 2D) input signal
         higher (in absolute value) than the threshold.
         @param C:         Input signal.
         '''
-        cost = 0
-        for c in C.flatten():
-           if (abs(c) > threshold):
-                cost = cost + 1
-        return cost
+        #Zero tiles are common for sparse signals: one cheap scan
+        #instead of materializing the abs array.
+        if not C.any():
+            return 0
+        if _bestbasis is not None:
+            return int(_bestbasis.cost_threshold(np.ascontiguousarray(C, dtype=np.float64).ravel(), threshold))
+        if _threshold_kernel is not None:
+            return int(_threshold_kernel(np.ascontiguousarray(C, dtype=np.float64).ravel(), threshold))
+        return int(np.count_nonzero(np.abs(C) > threshold))
     return cost_fixed_threshold
-        
+
 def cost_shannon(C):
     '''
-    Computes the Shannen entropy of a 2D input signal
+    Computes the Shannen entropy of a (1D or 2D) input signal
     @param C:         Input signal.
     '''
-    cost = 0
-    for c in C.flatten():
-        if (c != 0):
-            cost = cost - c*c*np.log2(abs(c))
-    return cost
+    #Zero tiles are common for sparse signals: one cheap scan instead of
+    #the mask, fancy indexing and log2 below.
+    if not C.any():
+        return 0.0
+    if _bestbasis is not None:
+        return _bestbasis.cost_shannon(np.ascontiguousarray(C, dtype=np.float64).ravel())
+    if _shannon_kernel is not None:
+        return _shannon_kernel(np.ascontiguousarray(C, dtype=np.float64).ravel())
+    A = np.ravel(C)
+    if A.size <= _SMALL_SIZE:
+        #Deep levels produce many small tiles: sum them as scalars.
+        cost = 0.0
+        for c in A.tolist():
+            if c != 0:
+                cost -= c*c*math.log(abs(c))
+        return cost * _INV_LN2
+    A = A[A != 0]
+    return -np.dot(A*A, np.log2(np.abs(A)))
 
 ###############################################################################
 # VISUALIZATIONS
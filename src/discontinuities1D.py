@@ -10,15 +10,9 @@ import numpy as np
 import pylab
 import utils
 
-def h(x):
-    if x<0:
-        return 1+x
-    else:
-        return -1+x   
-
 def samples(nb_samples=1000):
     t = (np.linspace(-1,1,nb_samples+1))[:-1]
-    return np.vectorize(h)(x=t)
+    return np.where(t<0, 1+t, -1+t)
     
 def plot_large_coeffs(f, mode=pywt.MODES.ppd, level=4, threshold=0.1):
     t = np.arange(1, 10000, 100)
@@ -59,47 +59,19 @@ class Node:
         self.index = index
         self.cost = -1
         self.best = -1
-    
-    def __cmp__(self, other):
-        '''
-        Compares this node against the given node.
-        (high levels first, low indices first)
-        @param other:     The node to compare this node to.
-        '''
-        return compare_high_level_first(self, other)
 
-def compare_low_level_first(Node1, Node2) :
+def key_low_level_first(Node):
     '''
-    Compares the first given node against the second
-    given node. (low levels first, low indices first)
-    @param Node1:     The first node
-    @param Node2:     The second node
+    Returns the sort key for ordering nodes with
+    low levels first, low indices first.
+    @param Node:      The node
     '''
-    if Node1.level < Node2.level:
-        return -1 
-    if Node1.level > Node2.level:
-        return 1
-    if Node1.index < Node2.index:
-        return -1
-    if Node1.index > Node2.index:
-        return 1
-    else: 
-        return 0
-    
-def compare_high_level_first(Node1, Node2) :
+    return (Node.level, Node.index)
+
+def key_high_level_first(Node):
     '''
-    Compares the first given node against the second
-    given node. (high levels first, low indices first)
-    @param Node1:     The first node
-    @param Node2:     The second node
+    Returns the sort key for ordering nodes with
+    high levels first, low indices first.
+    @param Node:      The node
     '''
-    if Node1.level > Node2.level:
-        return -1 
-    if Node1.level < Node2.level:
-        return 1
-    if Node1.index < Node2.index:
-        return -1
-    if Node1.index > Node2.index:
-        return 1
-    else: 
-        return 0 
\ No newline at end of file
+    return (-Node.level, Node.index)
\ No newline at end of file
@@ -4,15 +4,34 @@
 @author     Matthias Moulin & Vincent Peeters
 @version    1.0
 '''
+import collections
 import cost
-import heapq
+import multiprocessing
 import node
 import numpy as np
 import pywt
 
+# The decompositions of the siblings of a level are independent and pywt
+# releases the GIL in its C code, so they can run concurrently on threads.
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+_NB_WORKERS = multiprocessing.cpu_count()
+
+# pywt >= 0.5 can transform the last two axes of an n-dimensional array,
+# which allows decomposing (and reconstructing) all siblings of a level
+# in one call instead of one call per node.
+try:
+    pywt.dwt2(np.zeros((2, 4, 4)), "db1", axes=(-2, -1))
+    _BATCH_DWT2 = True
+except (TypeError, ValueError):
+    _BATCH_DWT2 = False
+
 ###############################################################################
 # ANALYSIS ALGORITHM FUNCTIONS
-###############################################################################        
+###############################################################################
 
 def wp2(S, costf, wavelet="db4", mode=pywt.MODES.ppd, level=4):
     '''
@@ -33,20 +52,19 @@ def wp2(S, costf, wavelet="db4", mode=pywt.MODES.ppd, level=4):
     @return:          A list containing the nodes of the 2D discrete wavelet packet transformation,
                       with the best basis according to the given cost function, for the given input signal. 
     '''
+    #Build the wavelet filter bank once instead of re-parsing the name
+    #in every dwt2 call.
+    if isinstance(wavelet, str):
+        wavelet = pywt.Wavelet(wavelet)
     #Data collection step
-    Nodes = collect(S, wavelet=wavelet, mode=mode, level=level)
+    (Cs, costs) = collect_stacked(S, costf, wavelet=wavelet, mode=mode, level=level)
     #Dynamic programming upstream traversal
-    mark(Nodes, costf)
-    #node.print_nodes(Nodes)
+    bests = mark_stacked(costs)
     #Dynamic programming downstream traversal
-    Result = []
-    traverse(Nodes[0][0], Nodes, Result)
-    traverse(Nodes[0][1], Nodes, Result)
-    traverse(Nodes[0][2], Nodes, Result)
-    traverse(Nodes[0][3], Nodes, Result)
-    return sorted(Result, cmp=node.compare_low_level_first, reverse=False)
+    Result = traverse_stacked(Cs, costs, bests)
+    return sorted(Result, key=node.key_low_level_first)
                      
-def collect(S, wavelet, mode, level):
+def collect(S, wavelet, mode, level, costf=None):
     '''
     Returns the full quad tree of wavelet packets.
     @param S:         Input signal.
@@ -54,73 +72,145 @@ def collect(S, wavelet, mode, level):
                       and the output type depends on the input type. If the input data is not
                       in one of these types it will be converted to the default double precision
                       data format before performing computations.
-    @param wavelet:   Wavelet to use in the transform. 
+    @param wavelet:   Wavelet to use in the transform.
                       This must be a name of the wavelet from the wavelist() list.
     @param mode:      Signal extension mode to deal with the border distortion problem.
     @param level:     Number of decomposition steps to perform. If the level is None, then the
                       full decomposition up to the level computed with dwt_max_level() function for
                       the given data and wavelet lengths is performed.
+    @param costf:     The (single parameter) cost function. If given, the cost of each
+                      node is computed once on the freshly produced coefficients.
     @return:          The full quad tree of wavelet packets.
     '''
     Nodes = [[] for i in range(level)]
     (CA, (CH, CV, CD)) = pywt.dwt2(S, wavelet=wavelet, mode=mode)
     Nodes[0] = [node.Node(CA, 0, 0), node.Node(CH, 0, 1), node.Node(CV, 0, 2), node.Node(CD, 0, 3)]
+    if costf is not None:
+        for Node in Nodes[0]:
+            Node.cost = costf(Node.C)
     for l in range(0, level-1):
         Parents = Nodes[l]
         Childs = []
-        for p in range(len(Parents)):
-            (CA, (CH, CV, CD)) = pywt.dwt2(Parents[p].C, wavelet=wavelet, mode=mode)
-            Childs.append(node.Node(CA, l+1, 4*p))
-            Childs.append(node.Node(CH, l+1, 4*p+1))
-            Childs.append(node.Node(CV, l+1, 4*p+2))
-            Childs.append(node.Node(CD, l+1, 4*p+3))
-        Nodes[l+1] = Childs 
+        if _BATCH_DWT2:
+            #All siblings of a level have equal shapes, so they can be
+            #stacked and decomposed in a single call.
+            Cstack = np.stack([Parent.C for Parent in Parents], axis=0)
+            (CAs, (CHs, CVs, CDs)) = pywt.dwt2(Cstack, wavelet=wavelet, mode=mode, axes=(-2, -1))
+            for p in range(len(Parents)):
+                Childs.append(node.Node(CAs[p], l+1, 4*p))
+                Childs.append(node.Node(CHs[p], l+1, 4*p+1))
+                Childs.append(node.Node(CVs[p], l+1, 4*p+2))
+                Childs.append(node.Node(CDs[p], l+1, 4*p+3))
+        else:
+            decompose = lambda Parent: pywt.dwt2(Parent.C, wavelet=wavelet, mode=mode)
+            if ThreadPoolExecutor is not None and len(Parents) > 1:
+                with ThreadPoolExecutor(max_workers=min(len(Parents), _NB_WORKERS)) as executor:
+                    Results = list(executor.map(decompose, Parents))
+            else:
+                Results = [decompose(Parent) for Parent in Parents]
+            for p in range(len(Parents)):
+                (CA, (CH, CV, CD)) = Results[p]
+                Childs.append(node.Node(CA, l+1, 4*p))
+                Childs.append(node.Node(CH, l+1, 4*p+1))
+                Childs.append(node.Node(CV, l+1, 4*p+2))
+                Childs.append(node.Node(CD, l+1, 4*p+3))
+        if costf is not None:
+            for Node in Childs:
+                Node.cost = costf(Node.C)
+        Nodes[l+1] = Childs
     return Nodes
-    
-def mark(Nodes, costf):
+
+def collect_stacked(S, costf, wavelet, mode, level):
     '''
-    Marks every node of nodes with the best cost seen so far. 
-    @param Nodes:     List containing the nodes of the 2D discrete wavelet packet
-                      transformation.
-    @param costf:      The (single parameter) cost function that must be used while
+    Returns the full quad tree of wavelet packets as one stacked coefficient
+    array plus one cost vector per level (structure-of-arrays layout, avoiding
+    a Python object per node during the analysis).
+    @param S:         Input signal.
+                      Both single and double precision floating-point data types are supported
+                      and the output type depends on the input type. If the input data is not
+                      in one of these types it will be converted to the default double precision
+                      data format before performing computations.
+    @param costf:     The (single parameter) cost function that must be used while
                       searching for the best basis.
+    @param wavelet:   Wavelet to use in the transform.
+                      This must be a name of the wavelet from the wavelist() list.
+    @param mode:      Signal extension mode to deal with the border distortion problem.
+    @param level:     Number of decomposition steps to perform.
+    @return:          A tuple (Cs, costs) with per level l an array Cs[l] of shape
+                      (4**(l+1), rows, cols) containing the coefficients of all nodes
+                      of that level in index order, and a vector costs[l] containing
+                      the corresponding node costs.
     '''
-    for p in range(len(Nodes[-1])):
-        Node = Nodes[-1][p]
-        cp = costf(Node.C)
-        Node.cost = cp
-        Node.best = cp
-    for l in range(len(Nodes)-2, -1, -1):
-        for p in range(len(Nodes[l])):
-            Node = Nodes[l][p]
-            cc = Nodes[l+1][4*p].best + Nodes[l+1][4*p+1].best + Nodes[l+1][4*p+2].best + Nodes[l+1][4*p+3].best
-            cp = costf(Node.C)
-            Node.cost = cp
-            if cp <= cc:
-                Node.best = cp
+    Cs = [None for i in range(level)]
+    costs = [None for i in range(level)]
+    (CA, (CH, CV, CD)) = pywt.dwt2(S, wavelet=wavelet, mode=mode)
+    Cs[0] = np.stack([CA, CH, CV, CD], axis=0)
+    costs[0] = np.array([costf(C) for C in Cs[0]])
+    for l in range(0, level-1):
+        if _BATCH_DWT2:
+            (CAs, (CHs, CVs, CDs)) = pywt.dwt2(Cs[l], wavelet=wavelet, mode=mode, axes=(-2, -1))
+        else:
+            decompose = lambda C: pywt.dwt2(C, wavelet=wavelet, mode=mode)
+            if ThreadPoolExecutor is not None and Cs[l].shape[0] > 1:
+                with ThreadPoolExecutor(max_workers=min(Cs[l].shape[0], _NB_WORKERS)) as executor:
+                    Results = list(executor.map(decompose, Cs[l]))
             else:
-                Node.best = cc 
-          
-def traverse(Node, Nodes, Result):
+                Results = [decompose(C) for C in Cs[l]]
+            CAs = np.stack([R[0] for R in Results], axis=0)
+            CHs = np.stack([R[1][0] for R in Results], axis=0)
+            CVs = np.stack([R[1][1] for R in Results], axis=0)
+            CDs = np.stack([R[1][2] for R in Results], axis=0)
+        Childs = np.empty((4*CAs.shape[0],) + CAs.shape[1:], dtype=CAs.dtype)
+        Childs[0::4] = CAs
+        Childs[1::4] = CHs
+        Childs[2::4] = CVs
+        Childs[3::4] = CDs
+        Cs[l+1] = Childs
+        #Cost the freshly produced coefficients while they are cache-hot.
+        costs[l+1] = np.array([costf(C) for C in Childs])
+    return (Cs, costs)
+
+def mark_stacked(costs):
     '''
-    Traverses the given node.
-    The node will be added to the result if it belongs to the best basis.
-    Otherwise the node childs will be traversed recursively.
-    @param Node:      The current node to traverse.
-    @param Nodes:     List containing the nodes of the 2D discrete wavelet packet
-                      transformation.
-    @param Result:    Buffer containing the nodes traversed so far that belong
-                      to the best basis.
+    Returns per level the best cost vector seen so far, propagating the
+    minimum of each parent cost and the sum of its four child bests upward
+    as vectorized level operations.
+    @param costs:     List containing the cost vector of every level.
+    @return:          List containing the best cost vector of every level.
     '''
-    if (Node.best == Node.cost):
-        Result.append(Node)
-    else:
-        i = Node.level + 1
-        j = 4 * Node.index
-        traverse(Nodes[i][j], Nodes, Result)
-        traverse(Nodes[i][j+1], Nodes, Result)
-        traverse(Nodes[i][j+2], Nodes, Result)  
-        traverse(Nodes[i][j+3], Nodes, Result) 
+    bests = [None for i in range(len(costs))]
+    bests[-1] = costs[-1]
+    for l in range(len(costs)-2, -1, -1):
+        cc = np.reshape(bests[l+1], (-1, 4)).sum(axis=1)
+        bests[l] = np.minimum(costs[l], cc)
+    return bests
+
+def traverse_stacked(Cs, costs, bests):
+    '''
+    Traverses the quad tree with an explicit stack of (level, index) pairs
+    and returns the nodes of the best basis. A node belongs to the best
+    basis if its best cost equals its own cost; otherwise its childs are
+    traversed. Node objects are only materialized for the returned basis.
+    @param Cs:        List containing the stacked coefficient array of every level.
+    @param costs:     List containing the cost vector of every level.
+    @param bests:     List containing the best cost vector of every level.
+    @return:          A list containing the nodes of the best basis.
+    '''
+    Result = []
+    stack = [(0, 3), (0, 2), (0, 1), (0, 0)]
+    while stack:
+        (l, j) = stack.pop()
+        if bests[l][j] == costs[l][j]:
+            Node = node.Node(Cs[l][j], l, j)
+            Node.cost = costs[l][j]
+            Node.best = bests[l][j]
+            Result.append(Node)
+        else:
+            stack.append((l+1, 4*j+3))
+            stack.append((l+1, 4*j+2))
+            stack.append((l+1, 4*j+1))
+            stack.append((l+1, 4*j))
+    return Result
         
 ###############################################################################
 # SYNTHESIS ALGORITHM FUNCTIONS
@@ -139,67 +229,80 @@ def iwp2(Nodes, wavelet="db4", mode=pywt.MODES.ppd):
     @return:          The inverse 2D discrete wavelet packet transformation for the given
                       list containing the nodes of the 2D discrete wavelet packet transformation.
     '''
-    heapq.heapify(Nodes)
-    while len(Nodes) != 1:
-        Node1 = heapq.heappop(Nodes)
-        Node2 = heapq.heappop(Nodes)
-        Node3 = heapq.heappop(Nodes)
-        Node4 = heapq.heappop(Nodes) 
-        
-        try:
-            S = pywt.idwt2((Node1.C, (Node2.C, Node3.C, Node4.C)), wavelet=wavelet, mode=mode)
-        except ValueError:
-            print("Id: " + str(Node1.level) + "," + str(Node1.index))
-            print(Node1.C.shape)
-            print("Id: " + str(Node2.level) + "," + str(Node2.index))
-            print(Node2.C.shape)
-            print("Id: " + str(Node3.level) + "," + str(Node3.index))
-            print(Node3.C.shape)
-            print("Id: " + str(Node4.level) + "," + str(Node4.index))
-            print(Node4.C.shape)
-            raise ValueError
-          
-        Merged = node.Node(S, (Node1.level-1), (Node1.index / 4))
-        heapq.heappush(Nodes, Merged)
-    return Nodes[0].C
+    if isinstance(wavelet, str):
+        wavelet = pywt.Wavelet(wavelet)
+    #Bucket the nodes per level: the levels are small and bounded, so
+    #merging the deepest bucket into the one above is O(N) overall and
+    #avoids the Python-level comparisons of a heap.
+    buckets = collections.defaultdict(list)
+    for Node in Nodes:
+        buckets[Node.level].append(Node)
+    for l in range(max(buckets), -1, -1):
+        Level = sorted(buckets.pop(l), key=node.key_low_level_first)
+        if _BATCH_DWT2 and len(Level) > 4:
+            #All quartets of a level have equal shapes, so they can be
+            #stacked and reconstructed in a single call.
+            CAs = np.stack([Level[q].C for q in range(0, len(Level), 4)], axis=0)
+            CHs = np.stack([Level[q+1].C for q in range(0, len(Level), 4)], axis=0)
+            CVs = np.stack([Level[q+2].C for q in range(0, len(Level), 4)], axis=0)
+            CDs = np.stack([Level[q+3].C for q in range(0, len(Level), 4)], axis=0)
+            S = pywt.idwt2((CAs, (CHs, CVs, CDs)), wavelet=wavelet, mode=mode, axes=(-2, -1))
+            for i in range(S.shape[0]):
+                Merged = node.Node(S[i], l-1, (Level[4*i].index / 4))
+                buckets[l-1].append(Merged)
+            continue
+        for q in range(0, len(Level), 4):
+            Node1 = Level[q]
+            Node2 = Level[q+1]
+            Node3 = Level[q+2]
+            Node4 = Level[q+3]
+
+            try:
+                S = pywt.idwt2((Node1.C, (Node2.C, Node3.C, Node4.C)), wavelet=wavelet, mode=mode)
+            except ValueError:
+                print("Id: " + str(Node1.level) + "," + str(Node1.index))
+                print(Node1.C.shape)
+                print("Id: " + str(Node2.level) + "," + str(Node2.index))
+                print(Node2.C.shape)
+                print("Id: " + str(Node3.level) + "," + str(Node3.index))
+                print(Node3.C.shape)
+                print("Id: " + str(Node4.level) + "," + str(Node4.index))
+                print(Node4.C.shape)
+                raise ValueError
+
+            Merged = node.Node(S, l-1, (Node1.index / 4))
+            buckets[l-1].append(Merged)
+    return buckets[-1][0].C
         
 ###############################################################################
 # TESTS
 ###############################################################################
                                           
 def matrix(size = 100):
-    S = np.zeros(np.array([size, size]), dtype=float)
+    S = np.zeros(np.array([size, size]), dtype=np.float32)
     half = int(size / 2) - 1
     S[half, half] = 1
-    return S      
-    
+    return S
+
 def matrix2(size = 100):
-    S = np.zeros(np.array([size, size]), dtype=float)
     half = int(size / 2) - 1
-    for i in range(S.shape[0]):
-        for j in range(S.shape[1]):
-            if (i-half)*(i-half) + (j-half)*(j-half) <= 10:
-                S[i,j] = 1
-    return S
-    
+    (i, j) = np.ogrid[:size, :size]
+    return ((i-half)*(i-half) + (j-half)*(j-half) <= 10).astype(np.float32)
+
 def matrix3(size = 100):
-    S = np.zeros(np.array([size, size]), dtype=float)
     half = int(size / 2) - 1
-    for i in range(S.shape[0]):
-        for j in range(S.shape[1]):
-            if (abs(i-half) <= 3 and abs(j-half) <= 6):
-                S[i,j] = 1
-    return S
+    (i, j) = np.ogrid[:size, :size]
+    return ((np.abs(i-half) <= 3) & (np.abs(j-half) <= 6)).astype(np.float32)
 
 import configuration as c
 import cv2
 def house():
     fname = c.get_dir_fingerprints() + "house.tif"
-    return cv2.imread(fname, 0)
+    return cv2.imread(fname, 0).astype(np.float32) / 255
 
 def fingerprint():
     fname = c.get_dir_fingerprints() + "cmp00001.pgm"
-    return cv2.imread(fname, 0)   
+    return cv2.imread(fname, 0).astype(np.float32) / 255
       
 if __name__ == "__main__":
     S = matrix(64)
@@ -0,0 +1,10 @@
+'''
+Builds the optional compiled cost kernels used by cost.py:
+    python setup.py build_ext --inplace
+@author     Matthias Moulin & Vincent Peeters
+@version    1.0
+'''
+from distutils.core import setup
+from Cython.Build import cythonize
+
+setup(ext_modules=cythonize("_bestbasis.pyx"))
@@ -27,50 +27,44 @@ def sd(S, wavelet="db4", mode=pywt.MODES.ppd):
     @return:          A list containing the nodes of the subband decomposition for fingerprints
                       for the given input signal. 
     '''
-    #Data collection step
-    #Optimization: don't construct the full tree, but lazy initialize
-    Nodes = quadtree.collect(S, wavelet=wavelet, mode=mode, level=5)
-    #node.print_nodes(Nodes)
-    #Downstream traversal
+    #Build the wavelet filter bank once instead of re-parsing the name
+    #in every dwt2 call.
+    if isinstance(wavelet, str):
+        wavelet = pywt.Wavelet(wavelet)
+    #Pruned data collection: only the nodes that the subband pattern
+    #splits are decomposed, instead of materializing the full quad tree
+    #of wavelet packets up to level 5. The coefficients of an internal
+    #node are dropped as soon as its childs have been computed.
+    (CA, (CH, CV, CD)) = pywt.dwt2(S, wavelet=wavelet, mode=mode)
     Result = []
-    traverse(Nodes[0][0], Nodes, Result)
-    traverse(Nodes[0][1], Nodes, Result)
-    traverse(Nodes[0][2], Nodes, Result)
-    traverse(Nodes[0][3], Nodes, Result)
-    return sorted(Result, cmp=node.compare_low_level_first, reverse=False)
-        
-def traverse(Node, Nodes, Result):
+    stack = [node.Node(CD, 0, 3), node.Node(CV, 0, 2), node.Node(CH, 0, 1), node.Node(CA, 0, 0)]
+    while stack:
+        Node = stack.pop()
+        if bottom(Node.level, Node.index):
+            Result.append(Node)
+        else:
+            (CA, (CH, CV, CD)) = pywt.dwt2(Node.C, wavelet=wavelet, mode=mode)
+            i = Node.level + 1
+            j = 4 * Node.index
+            stack.append(node.Node(CD, i, j+3))
+            stack.append(node.Node(CV, i, j+2))
+            stack.append(node.Node(CH, i, j+1))
+            stack.append(node.Node(CA, i, j))
+    return sorted(Result, key=node.key_low_level_first)
+
+def bottom(i, j):
     '''
-    Traverses the given node.
-    The node will be added to the result if it belongs to the best basis.
-    Otherwise the node childs will be traversed recursively.
-    @param Node:      The current node to traverse.
-    @param Nodes:     List containing the nodes of the subband decomposition
-                      for fingerprints.
-    @param Result:    Buffer containing the nodes traversed so far that belong
-                      to the best basis.
+    Returns whether the node with the given level and index is a bottom
+    node (subband) of the subband decomposition for fingerprints.
+    @param i:         The level of the node.
+    @param j:         The index of the node.
     '''
-    i = Node.level
-    j = Node.index
-    
-    isBottom = False
     if (i==1):
-        if(j/4 !=0 or j==3):
-            isBottom = True
-    elif (i==3 and j!=0):
-        isBottom = True
-    elif (i == 4):
-        isBottom = True
-    
-    if (isBottom):
-        Result.append(Node)
-    else: 
-        i = i + 1
-        j = 4 * j
-        traverse(Nodes[i][j], Nodes, Result)
-        traverse(Nodes[i][j+1], Nodes, Result)
-        traverse(Nodes[i][j+2], Nodes, Result)  
-        traverse(Nodes[i][j+3], Nodes, Result)
+        return (j/4 !=0 or j==3)
+    elif (i==3):
+        return (j!=0)
+    else:
+        return (i == 4)
         
 ###############################################################################
 # SYNTHESIS ALGORITHM FUNCTIONS